@@ -1,4 +1,4 @@
-from agents import Runner, Agent, function_tool, trace, gen_trace_id
+from agents import Runner, RunResult, Agent, function_tool, trace, gen_trace_id
 from clarifier_agent import clarifier_agent, ClarificationQuestions
 from search_agent import search_agent
 from planner_agent import planner_agent, WebSearchItem, WebSearchPlan
@@ -7,6 +7,25 @@ from email_agent import email_agent
 import asyncio
 from typing import Dict, Any
 
+# Planning guidance used when the user gave no clarifications
+DEFAULT_PLANNING_REQUIREMENTS = [
+    "- Plan comprehensive searches covering multiple angles of the topic",
+]
+
+def format_planning_requirements(requirements: list[str]) -> str:
+    """Format planner-only search requirements as a context section"""
+    return "\n".join(["=== SEARCH PLANNING REQUIREMENTS ===", *requirements])
+
+def planner_input(research_context: str, planning_requirements: str = "") -> str:
+    """Build planner input: research context first, planning requirements last"""
+    if not planning_requirements:
+        planning_requirements = format_planning_requirements(DEFAULT_PLANNING_REQUIREMENTS)
+    return f"{research_context}\n\n{planning_requirements}"
+
+def writer_input(research_context: str, search_results: str) -> str:
+    """Build writer input: stable research context first, search results last"""
+    return f"{research_context}\n\n=== SEARCH RESULTS ===\n{search_results}"
+
 # Define function tools for each agent
 @function_tool
 async def get_clarification_questions(query: str) -> Dict[str, Any]:
@@ -22,7 +41,7 @@ async def get_clarification_questions(query: str) -> Dict[str, Any]:
 @function_tool
 async def plan_research_searches(research_context: str) -> Dict[str, Any]:
     """Plan web searches based on research context including clarifications"""
-    result = await Runner.run(planner_agent, research_context)
+    result = await Runner.run(planner_agent, planner_input(research_context))
     search_plan = result.final_output_as(WebSearchPlan)
     return {
         "searches": [{"reason": s.reason, "query": s.query, "priority": s.priority} 
@@ -43,8 +62,7 @@ async def perform_web_search(search_query: str, search_reason: str) -> str:
 @function_tool
 async def write_research_report(research_context: str, search_results: str) -> Dict[str, Any]:
     """Write a comprehensive research report"""
-    input_text = f"{research_context}\n\nSummarized search results: {search_results}"
-    result = await Runner.run(writer_agent, input_text)
+    result = await Runner.run(writer_agent, writer_input(research_context, search_results))
     report = result.final_output_as(ReportData)
     return {
         "short_summary": report.short_summary,
@@ -80,6 +98,30 @@ manager_agent = Agent(
 
 class ResearchManager:
     """Wrapper class to maintain compatibility while using Agent underneath"""
+
+    @staticmethod
+    def _record_usage(cache_stats: Dict[str, Dict[str, int]], stage: str, result: RunResult) -> None:
+        """Accumulate input and cached input tokens reported for a stage"""
+        usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+        if usage is None:
+            return
+        details = getattr(usage, "input_tokens_details", None)
+        stats = cache_stats.setdefault(stage, {"input_tokens": 0, "cached_tokens": 0})
+        stats["input_tokens"] += getattr(usage, "input_tokens", 0) or 0
+        stats["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+
+    @staticmethod
+    def cache_hit_summary(cache_stats: Dict[str, Dict[str, int]], trace_id: str = "") -> str:
+        """Format the cached-token hit rate for each stage of a run"""
+        label = f"Prompt cache hits [trace {trace_id}]" if trace_id else "Prompt cache hits"
+        if not cache_stats:
+            return f"{label}: no usage recorded"
+        parts = []
+        for stage, stats in cache_stats.items():
+            total = stats["input_tokens"]
+            rate = stats["cached_tokens"] / total * 100 if total else 0.0
+            parts.append(f"{stage} {stats['cached_tokens']}/{total} ({rate:.0f}%)")
+        return f"{label}: " + ", ".join(parts)
     
     async def get_clarification_questions(self, query: str) -> ClarificationQuestions:
         """Get clarification questions for a research query"""
@@ -121,6 +163,7 @@ class ResearchManager:
             
             # Create research context with questions and answers
             research_context = self.create_research_context(query, clarifications, questions)
+            planning_requirements = self.create_planning_requirements(clarifications, questions)
             yield "Research context prepared..."
             
             # Use manager agent to coordinate the research
@@ -137,14 +180,17 @@ Follow the complete research workflow:
 Provide status updates for each step."""
             
             # Always use fallback workflow for reliability and full report display
-            async for chunk in self._fallback_workflow(research_context):
+            async for chunk in self._fallback_workflow(research_context, planning_requirements, trace_id):
                 yield chunk
 
-    async def _fallback_workflow(self, research_context: str):
+    async def _fallback_workflow(self, research_context: str, planning_requirements: str = "", trace_id: str = ""):
         """Fallback workflow if manager agent fails"""
+        # Local to this run: one ResearchManager is shared by all UI sessions
+        cache_stats: Dict[str, Dict[str, int]] = {}
         try:
             # Plan searches
-            result = await Runner.run(planner_agent, research_context)
+            result = await Runner.run(planner_agent, planner_input(research_context, planning_requirements))
+            self._record_usage(cache_stats, "planner", result)
             search_plan = result.final_output_as(WebSearchPlan)
             yield "Searches planned, starting to search..."
             
@@ -157,6 +203,7 @@ Provide status updates for each step."""
                         f"Search term: {search_item.query}\nReason for searching: {search_item.reason}"
                     )
                     search_results.append(str(result.final_output))
+                    self._record_usage(cache_stats, "search", result)
                     yield f"Search {i+1}/{len(search_plan.searches)} completed"
                 except:
                     continue
@@ -164,21 +211,23 @@ Provide status updates for each step."""
             yield "Searches complete, writing report..."
             
             # Write report
-            result = await Runner.run(
-                writer_agent,
-                f"{research_context}\n\nSearch results: {search_results}"
-            )
+            result = await Runner.run(writer_agent, writer_input(research_context, str(search_results)))
+            self._record_usage(cache_stats, "writer", result)
             report = result.final_output_as(ReportData)
             
             yield "Report written, sending email..."
             
             # Send email
-            await Runner.run(email_agent, report.markdown_report)
+            result = await Runner.run(email_agent, report.markdown_report)
+            self._record_usage(cache_stats, "email", result)
             yield "Email sent, research complete"
+            yield self.cache_hit_summary(cache_stats, trace_id)
             yield report.markdown_report
             
         except Exception as e:
             yield f"Fallback workflow failed: {e}"
+        finally:
+            print(self.cache_hit_summary(cache_stats, trace_id))
 
     async def run(self, query: str):
         """Simple run method for backward compatibility"""
@@ -186,54 +235,56 @@ Provide status updates for each step."""
             yield chunk
 
     def create_research_context(self, query: str, clarifications: str, questions: list = None) -> str:
-        """Create research context from query, clarifications, and questions"""
+        """Create research context from query, clarifications, and questions.
+
+        The layout is fixed (header, query, clarifications) and built only from
+        normalized inputs, so identical requests yield identical context text.
+        """
         context_parts = [
             "=== RESEARCH CONTEXT ===",
-            f"Original Query: {query}"
+            f"Original Query: {query.strip()}"
         ]
+        clarification_lines = [line.strip() for line in clarifications.strip().split('\n') if line.strip()]
         
-        if clarifications.strip() and questions:
+        if clarification_lines and questions:
             context_parts.append(f"\n=== CLARIFYING QUESTIONS & ANSWERS ===")
             context_parts.append("The user was asked clarifying questions and provided these specific responses:")
             
-            # Parse clarifications (assume one per line)
-            clarification_lines = [line.strip() for line in clarifications.strip().split('\n') if line.strip()]
-            
-            # Match questions with answers
+            # Match questions with answers (assume one answer per line)
             for i, (question_data, answer) in enumerate(zip(questions, clarification_lines), 1):
-                if i <= len(clarification_lines):
-                    context_parts.append(f"\n**Question {i} ({question_data.get('category', 'general')}):** {question_data.get('question', 'N/A')}")
-                    context_parts.append(f"**User's Answer:** {answer}")
-                    context_parts.append(f"**Purpose:** {question_data.get('purpose', 'N/A')}")
-                else:
-                    # Question without answer
-                    context_parts.append(f"\n**Question {i} ({question_data.get('category', 'general')}):** {question_data.get('question', 'N/A')}")
-                    context_parts.append(f"**User's Answer:** [No answer provided]")
-                    context_parts.append(f"**Purpose:** {question_data.get('purpose', 'N/A')}")
-            
-            context_parts.append(f"\n=== SEARCH PLANNING REQUIREMENTS ===")
-            context_parts.append("- Each search must directly address the user's clarified needs above")
-            context_parts.append("- Prioritize searches based on the question categories and user responses")
-            context_parts.append("- Tailor search depth and perspective to the clarified audience and purpose")
-            context_parts.append("- Consider the clarified constraints (timeline, geography, scope, etc.)")
-            context_parts.append("- Use the question purposes to guide search strategy")
+                context_parts.append(f"\n**Question {i} ({question_data.get('category', 'general')}):** {question_data.get('question', 'N/A')}")
+                context_parts.append(f"**User's Answer:** {answer}")
+                context_parts.append(f"**Purpose:** {question_data.get('purpose', 'N/A')}")
             
-        elif clarifications.strip():
+        elif clarification_lines:
             # Fallback for when we have answers but no questions structure
             context_parts.append(f"\n=== USER CLARIFICATIONS ===")
             context_parts.append("The user provided these specific clarifications to focus the research:")
             
-            clarification_lines = [line.strip() for line in clarifications.strip().split('\n') if line.strip()]
             for i, clarification in enumerate(clarification_lines, 1):
                 context_parts.append(f"{i}. {clarification}")
             
-            context_parts.append(f"\n=== SEARCH PLANNING REQUIREMENTS ===")
-            context_parts.append("- Each search must directly address at least one of the user clarifications above")
-            context_parts.append("- Prioritize searches that serve the user's specific focus areas")
-            
         else:
-            context_parts.append(f"\n=== SEARCH PLANNING REQUIREMENTS ===")
-            context_parts.append("- No specific clarifications provided")
-            context_parts.append("- Plan comprehensive searches covering multiple angles of the topic")
+            context_parts.append(f"\n=== USER CLARIFICATIONS ===")
+            context_parts.append("No specific clarifications provided.")
         
-        return "\n".join(context_parts)
\ No newline at end of file
+        return "\n".join(context_parts)
+
+    def create_planning_requirements(self, clarifications: str, questions: list | None = None) -> str:
+        """Create planner-only search requirements, appended after the shared context"""
+        if clarifications.strip() and questions:
+            requirements = [
+                "- Each search must directly address the user's clarified needs above",
+                "- Prioritize searches based on the question categories and user responses",
+                "- Tailor search depth and perspective to the clarified audience and purpose",
+                "- Consider the clarified constraints (timeline, geography, scope, etc.)",
+                "- Use the question purposes to guide search strategy",
+            ]
+        elif clarifications.strip():
+            requirements = [
+                "- Each search must directly address at least one of the user clarifications above",
+                "- Prioritize searches that serve the user's specific focus areas",
+            ]
+        else:
+            requirements = DEFAULT_PLANNING_REQUIREMENTS
+        return format_planning_requirements(requirements)